@@ -1,18 +1,33 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, make_response, session
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-import requests
-import base64
-import json
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+import orjson
+try:
+    import pybase64 as base64
+except ImportError:  # Fall back to the stdlib decoder
+    import base64
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import generate_etag
 from werkzeug.security import check_password_hash, generate_password_hash
 from config import Config
-from models import db, Employee, AttendanceLog, FaceImage
+from models import db, Employee, AttendanceLog, FaceImage, DailyAttendanceSummary, record_daily_summary, upsert, on_conflict_update
+from utils import ORJSONProvider, StreamBody, SESSION, COMPREFACE_BASE_URL, base64_payload, get_ist_time, utc_to_ist, ist_day_bounds_utc, month_range
 from datetime import datetime, timedelta, date
-from sqlalchemy import func, and_, extract
+from sqlalchemy import func, case, exists, insert, literal, select
+from sqlalchemy.orm import load_only, selectinload
+from collections import defaultdict
 import uuid
-import pytz
+import io
+import time
+import logging
+import threading
+
+logging.basicConfig(level=Config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = ORJSONProvider(app)
 
 # Initialize extensions
 db.init_app(app)
@@ -23,27 +38,75 @@ login_manager.login_view = 'login'
 # Create tables
 with app.app_context():
     db.create_all()
+    # create_all() only adds indexes along with new tables
+    for index in AttendanceLog.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+def daily_attendance_query(*criteria):
+    """Query first IN and last OUT per employee per day, aggregated in SQL"""
+    day = func.date(AttendanceLog.timestamp, type_=db.Date)
+    return db.session.query(
+        AttendanceLog.employee_id,
+        day.label('day'),
+        func.min(case((AttendanceLog.log_type == 'IN', AttendanceLog.timestamp))).label('in_time'),
+        func.max(case((AttendanceLog.log_type == 'OUT', AttendanceLog.timestamp))).label('out_time')
+    ).filter(*criteria).group_by(AttendanceLog.employee_id, day)
+
+def backfill_daily_summaries():
+    """Write DailyAttendanceSummary rows for days that are missing or out of date"""
+    logged = daily_attendance_query().subquery()
+    up_to_date = exists().where(
+        DailyAttendanceSummary.employee_id == logged.c.employee_id,
+        DailyAttendanceSummary.day == logged.c.day,
+        DailyAttendanceSummary.first_in.is_not_distinct_from(logged.c.in_time),
+        DailyAttendanceSummary.last_out.is_not_distinct_from(logged.c.out_time)
+    )
+    stmt = upsert(DailyAttendanceSummary).from_select(
+        ['employee_id', 'day', 'first_in', 'last_out'],
+        select(logged).where(~up_to_date)
+    )
+    # The logs are authoritative, so an existing row takes the aggregated values
+    result = db.session.execute(on_conflict_update(
+        stmt, ['employee_id', 'day'],
+        lambda new: {'first_in': new.first_in, 'last_out': new.last_out}
+    ))
+    db.session.commit()
+    return result.rowcount
 
-# Timezone helper functions
-def get_ist_time():
-    """Get current time in IST"""
-    return datetime.now(Config.TIMEZONE)
-
-def utc_to_ist(utc_dt):
-    """Convert UTC datetime to IST"""
-    if utc_dt is None:
-        return None
-    if utc_dt.tzinfo is None:
-        utc_dt = pytz.UTC.localize(utc_dt)
-    return utc_dt.astimezone(Config.TIMEZONE)
-
-def ist_to_utc(ist_dt):
-    """Convert IST datetime to UTC for database storage"""
-    if ist_dt is None:
-        return None
-    if ist_dt.tzinfo is None:
-        ist_dt = Config.TIMEZONE.localize(ist_dt)
-    return ist_dt.astimezone(pytz.UTC).replace(tzinfo=None)
+@app.cli.command('backfill-summaries')
+def backfill_summaries_command():
+    """Rebuild daily attendance summaries from the logs (run once after upgrading)"""
+    print(f"Updated {backfill_daily_summaries()} daily summaries")
+
+# Window in which a second log of the same type counts as a duplicate
+RECENT_LOG_WINDOW = timedelta(minutes=Config.MINIMUM_INTERVAL_MINUTES)
+
+def insert_log_unless_recent(employee_id, log_type, similarity, confidence, timestamp):
+    """Insert an attendance log unless one of the same type is within the minimum interval"""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # Under READ COMMITTED two concurrent statements can both see no recent
+        # log; serialize per employee until commit. SQLite already has one writer.
+        db.session.execute(select(func.pg_advisory_xact_lock(employee_id)))
+    threshold = timestamp - RECENT_LOG_WINDOW
+    recent = exists().where(
+        AttendanceLog.employee_id == employee_id,
+        AttendanceLog.timestamp > threshold,
+        AttendanceLog.log_type == log_type
+    )
+    # INSERT ... SELECT ... WHERE NOT EXISTS checks and writes in one statement,
+    # which SQLite runs under its write lock
+    values = select(
+        literal(employee_id), literal(log_type), literal(similarity),
+        literal(confidence), literal(timestamp), literal(timestamp)
+    ).where(~recent)
+    result = db.session.execute(
+        insert(AttendanceLog).from_select(
+            ['employee_id', 'log_type', 'similarity_score',
+             'confidence_score', 'timestamp', 'created_at'],
+            values
+        )
+    )
+    return result.rowcount > 0
 
 # Add timezone filter for templates
 @app.template_filter('to_ist')
@@ -66,17 +129,151 @@ class User(UserMixin):
     def __init__(self, username):
         self.id = username
 
+# Known usernames for the per-request session lookup in load_user
+USER_IDS = frozenset(Config.USERS)
+
+# Hash the configured passwords once so login never compares plaintext
+USERS_HASHED = {
+    username: generate_password_hash(password)
+    for username, password in Config.USERS.items()
+}
+# Checked for unknown usernames so every login costs one hash verification
+_DUMMY_PASSWORD_HASH = generate_password_hash(uuid.uuid4().hex)
+
 @login_manager.user_loader
 def load_user(user_id):
-    if user_id in Config.USERS:
-        return User(user_id)
-    return None
+    return User(user_id) if user_id in USER_IDS else None
+
+def decode_image_data(image_data):
+    """Decode a base64 image (optionally a data URL) into raw bytes"""
+    payload = base64_payload(image_data)
+    try:
+        return base64.b64decode(payload, validate=True)
+    except ValueError:
+        # Rare URL-safe payloads ('-'/'_') only pay for a second decode
+        return base64.urlsafe_b64decode(payload)
+
+def open_image(image_upload, image_data):
+    """Get a seekable stream and its size for an uploaded or base64 image"""
+    if image_upload:
+        # Reuse Werkzeug's spooled upload buffer instead of copying it
+        stream = image_upload.stream
+    else:
+        # base64 is 4/3 the binary size; skip decoding (stream None) when too large
+        decoded_size = len(image_data) * 3 // 4
+        if decoded_size > Config.MAX_IMAGE_BYTES:
+            return None, decoded_size
+        stream = io.BytesIO(decode_image_data(image_data))
+    stream.seek(0, io.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return stream, size
 
 # CompreFace API endpoints
-COMPREFACE_BASE_URL = f"{Config.COMPREFACE_URL}/api/v1"
-HEADERS = {
-    'x-api-key': Config.COMPREFACE_API_KEY
-}
+FACES_URL = f"{COMPREFACE_BASE_URL}/recognition/faces"
+RECOGNIZE_URL = f"{COMPREFACE_BASE_URL}/recognition/recognize"
+SUBJECTS_URL = f"{COMPREFACE_BASE_URL}/recognition/subjects"
+SUBJECT_URL = SUBJECTS_URL + "/{}"
+FACE_URL = FACES_URL + "/{}"
+JPEG_CONTENT_TYPE = 'image/jpeg'
+
+# Bound in-flight CompreFace calls so bursts queue here instead of piling onto the GPU
+COMPREFACE_SEMAPHORE = threading.BoundedSemaphore(Config.COMPREFACE_MAX_CONCURRENCY)
+
+def compreface_request(method, url, timeout=30, **kwargs):
+    """Send a request to the CompreFace API and return the response"""
+    with COMPREFACE_SEMAPHORE:
+        return SESSION.request(
+            method,
+            url,
+            timeout=timeout,
+            **kwargs
+        )
+
+# Short-lived cache of the CompreFace subject list as (subjects, expires).
+# invalidate_subjects_cache() bumps the generation so a fetch that started
+# before an enrollment or delete never stores its stale list.
+_subjects_cache = {'entry': None, 'generation': 0}
+_subjects_cache_lock = threading.Lock()
+
+def get_compreface_subjects():
+    """Get subject names from CompreFace, cached for SUBJECTS_CACHE_SECONDS"""
+    now = time.monotonic()
+    entry = _subjects_cache['entry']
+    if entry is not None and now < entry[1]:
+        return entry[0]
+    generation = _subjects_cache['generation']
+    
+    response = compreface_request('GET', SUBJECTS_URL, timeout=10)
+    if response.status_code != 200:
+        return []
+    
+    subjects = orjson.loads(response.content).get('subjects', [])
+    with _subjects_cache_lock:
+        if _subjects_cache['generation'] == generation:
+            _subjects_cache['entry'] = (subjects, now + Config.SUBJECTS_CACHE_SECONDS)
+    return subjects
+
+def invalidate_subjects_cache():
+    """Drop the cached subject list after enrolling or deleting a subject"""
+    with _subjects_cache_lock:
+        _subjects_cache['generation'] += 1
+        _subjects_cache['entry'] = None
+
+def compreface_upload(url, params, image_stream, filename, timeout=30):
+    """POST an image to CompreFace as a streamed multipart body"""
+    encoder = MultipartEncoder(
+        fields={'file': (filename, StreamBody(image_stream), JPEG_CONTENT_TYPE)}
+    )
+    return compreface_request(
+        'POST',
+        url,
+        params=params,
+        data=encoder,
+        headers={'Content-Type': encoder.content_type},
+        timeout=timeout
+    )
+
+# CompreFace subject name -> the Employee fields api_clock needs
+_employee_by_subject = {}
+_employee_by_subject_lock = threading.Lock()
+
+def get_employee_for_subject(subject_name):
+    """Look up the employee enrolled as a CompreFace subject, caching the result"""
+    employee = _employee_by_subject.get(subject_name)
+    if employee is None:
+        # Only the displayed columns; no need to hydrate a full Employee
+        record = db.session.query(
+            Employee.id, Employee.full_name, Employee.employee_id, Employee.department
+        ).filter_by(subject_name=subject_name).first()
+        if record is None:
+            return None
+        employee = {
+            'id': record.id,
+            'name': record.full_name,
+            'employee_id': record.employee_id,
+            'department': record.department
+        }
+        with _employee_by_subject_lock:
+            employee = _employee_by_subject.setdefault(subject_name, employee)
+    return employee
+
+def forget_employee_for_subject(subject_name):
+    """Drop a cached subject lookup after the employee is added or deleted"""
+    with _employee_by_subject_lock:
+        _employee_by_subject.pop(subject_name, None)
+
+def compreface_error_message(response, default):
+    """Translate a failed CompreFace enrollment response into a user-facing message"""
+    try:
+        message = orjson.loads(response.content).get('message', '')
+    except ValueError:
+        return default
+    if 'No face is found' in message:
+        return 'No face detected in the photo. Please retake it facing the camera.'
+    if 'More than one face' in message:
+        return 'More than one face detected. Please make sure only one person is in the photo.'
+    return f'{default}: {message}' if message else default
 
 # Routes
 @app.route('/')
@@ -94,7 +291,10 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
         
-        if username in Config.USERS and Config.USERS[username] == password:
+        stored_hash = USERS_HASHED.get(username)
+        password_ok = check_password_hash(stored_hash or _DUMMY_PASSWORD_HASH, password or '')
+        
+        if stored_hash and password_ok:
             user = User(username)
             login_user(user)
             return redirect(url_for('dashboard'))
@@ -109,18 +309,22 @@ def logout():
     logout_user()
     return redirect(url_for('login'))
 
-@app.route('/dashboard')
-@login_required
-def dashboard():
-    # Get all employees from database
-    employees = Employee.query.filter_by(is_active=True).all()
+# Today's dashboard attendance summary, cached briefly between punches as
+# (day, rows, expires); the generation works as in _subjects_cache
+_today_summary_cache = {'entry': None, 'generation': 0}
+_today_summary_cache_lock = threading.Lock()
+
+def get_today_attendance_summary(today_ist):
+    """Get first and last punch per employee for an IST day, cached briefly"""
+    now = time.monotonic()
+    entry = _today_summary_cache['entry']
+    if entry is not None and entry[0] == today_ist and now < entry[2]:
+        return entry[1]
+    generation = _today_summary_cache['generation']
     
-    # Get today's attendance summary in IST
-    today_ist = get_ist_time().date()
-    today_start_utc = ist_to_utc(datetime.combine(today_ist, datetime.min.time()))
-    today_end_utc = ist_to_utc(datetime.combine(today_ist, datetime.max.time()))
+    today_start_utc, today_end_utc = ist_day_bounds_utc(today_ist)
     
-    attendance_summary = db.session.query(
+    rows = db.session.query(
         Employee.full_name,
         func.min(AttendanceLog.timestamp).label('first_in'),
         func.max(AttendanceLog.timestamp).label('last_out')
@@ -131,9 +335,52 @@ def dashboard():
         AttendanceLog.timestamp <= today_end_utc
     ).group_by(Employee.id).all()
     
-    return render_template('dashboard.html', 
-                         employees=employees, 
-                         attendance_summary=attendance_summary)
+    with _today_summary_cache_lock:
+        if _today_summary_cache['generation'] == generation:
+            _today_summary_cache['entry'] = (today_ist, rows, now + Config.TODAY_SUMMARY_CACHE_SECONDS)
+    return rows
+
+def invalidate_today_summary_cache():
+    """Drop the cached dashboard summary after a new attendance log"""
+    with _today_summary_cache_lock:
+        _today_summary_cache['generation'] += 1
+        _today_summary_cache['entry'] = None
+
+@app.route('/dashboard')
+@login_required
+def dashboard():
+    # Get all employees from database, with face images for the per-row count
+    employees = db.session.execute(
+        select(Employee).filter_by(is_active=True).options(
+            selectinload(Employee.face_images)
+        )
+    ).scalars().all()
+    
+    # Get today's attendance summary in IST
+    attendance_summary = get_today_attendance_summary(get_ist_time().date())
+    
+    # The page depends only on the active employees (no route edits their
+    # details), their face counts, today's summary and the signed-in user, so
+    # derive the ETag from those and skip rendering when the browser's copy
+    # still matches. Pending flash messages always get a fresh render.
+    etag = generate_etag(orjson.dumps([
+        current_user.id,
+        [(employee.id, len(employee.face_images)) for employee in employees],
+        [tuple(row) for row in attendance_summary]
+    ]))
+    if etag in request.if_none_match and '_flashes' not in session:
+        response = make_response('', 304)
+    else:
+        response = make_response(render_template('dashboard.html', 
+                             employees=employees, 
+                             attendance_summary=attendance_summary))
+    
+    # no-cache (not max-age) so a redirect here after adding/deleting an
+    # employee always revalidates instead of showing a stale copy
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/add_employee', methods=['GET', 'POST'])
 @login_required
@@ -148,113 +395,123 @@ def add_employee():
         designation = request.form.get('designation')
         date_joined = datetime.strptime(request.form.get('date_joined'), '%Y-%m-%d').date()
         salary = float(request.form.get('salary', 0))
+        image_upload = request.files.get('file')
         image_data = request.form.get('image_data')
         
         # Generate subject name for CompreFace
         subject_name = f"emp_{employee_id}"
         
-        print(f"Creating employee with subject name: {subject_name}")  # Debug log
+        logger.debug("Creating employee with subject name: %s", subject_name)
         
-        if not image_data:
+        if not image_upload and not image_data:
             flash('Please capture at least one photo', 'danger')
             return render_template('add_employee.html')
         
         try:
             # Check if employee already exists
-            existing = Employee.query.filter(
-                (Employee.employee_id == employee_id) | 
-                (Employee.email == email)
+            existing = db.session.execute(
+                select(Employee.id).where(
+                    (Employee.employee_id == employee_id) | 
+                    (Employee.email == email)
+                ).limit(1)
             ).first()
             
             if existing:
                 flash('Employee with this ID or email already exists', 'danger')
                 return render_template('add_employee.html')
             
-            # Create employee record
-            employee = Employee(
-                subject_name=subject_name,
-                employee_id=employee_id,
-                full_name=full_name,
-                email=email,
-                phone=phone,
-                department=department,
-                designation=designation,
-                date_joined=date_joined,
-                salary=salary
-            )
-            db.session.add(employee)
-            db.session.flush()  # Get the ID without committing
-            
-            # Process and add face to CompreFace
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
+            # Add face to CompreFace first so no transaction is open during the call
+            image_stream, image_size = open_image(image_upload, image_data)
             
-            image_binary = base64.b64decode(image_data)
+            if image_size > Config.MAX_IMAGE_BYTES:
+                flash('Photo is too large. Please retake it.', 'danger')
+                return render_template('add_employee.html')
             
-            # Add face to CompreFace
-            response = requests.post(
-                f"{COMPREFACE_BASE_URL}/recognition/faces",
-                headers=HEADERS,
-                params={'subject': subject_name, 'det_prob_threshold': 0.8},
-                files={'file': ('image.jpg', image_binary, 'image/jpeg')},
-                timeout=30
+            response = compreface_upload(
+                FACES_URL,
+                {'subject': subject_name, 'det_prob_threshold': 0.8},
+                image_stream,
+                'image.jpg'
             )
             
             if response.status_code == 201:
-                result = response.json()
+                result = orjson.loads(response.content)
                 image_id = result.get('image_id')
                 
-                # Store face image reference
-                face_image = FaceImage(
-                    employee_id=employee.id,
+                # Create employee record and face image reference together
+                employee = Employee(
+                    subject_name=subject_name,
+                    employee_id=employee_id,
+                    full_name=full_name,
+                    email=email,
+                    phone=phone,
+                    department=department,
+                    designation=designation,
+                    date_joined=date_joined,
+                    salary=salary
+                )
+                employee.face_images.append(FaceImage(
                     image_id=image_id,
                     is_primary=True
-                )
-                db.session.add(face_image)
-                db.session.commit()
+                ))
+                db.session.add(employee)
+                
+                try:
+                    db.session.commit()
+                except Exception:
+                    # Undo the CompreFace side since the employee was not saved
+                    db.session.rollback()
+                    compreface_request('DELETE', FACE_URL.format(image_id), timeout=10)
+                    invalidate_subjects_cache()
+                    raise
+                
+                invalidate_subjects_cache()
+                forget_employee_for_subject(subject_name)
                 
                 flash(f'Successfully added employee: {full_name}', 'success')
                 return redirect(url_for('dashboard'))
             else:
-                db.session.rollback()
-                flash(f'Failed to add face to recognition system', 'danger')
+                flash(compreface_error_message(
+                    response, 'Failed to add face to recognition system'
+                ), 'danger')
                 
         except Exception as e:
             db.session.rollback()
             flash(f'Error adding employee: {str(e)}', 'danger')
-            print(f"Exception: {str(e)}")
+            logger.exception("Error adding employee %s", employee_id)
     
     return render_template('add_employee.html')
 
 @app.route('/add_face/<int:employee_id>', methods=['GET', 'POST'])
 @login_required
 def add_face(employee_id):
-    employee = Employee.query.get_or_404(employee_id)
+    employee = db.get_or_404(Employee, employee_id)
     
     if request.method == 'POST':
+        image_upload = request.files.get('file')
         image_data = request.form.get('image_data')
         
-        if not image_data:
+        if not image_upload and not image_data:
             flash('Please capture a photo', 'danger')
             return render_template('add_face.html', employee=employee)
         
         try:
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
+            image_stream, image_size = open_image(image_upload, image_data)
             
-            image_binary = base64.b64decode(image_data)
+            if image_size > Config.MAX_IMAGE_BYTES:
+                flash('Photo is too large. Please retake it.', 'danger')
+                return render_template('add_face.html', employee=employee)
             
             # Add additional face to CompreFace
-            response = requests.post(
-                f"{COMPREFACE_BASE_URL}/recognition/faces",
-                headers=HEADERS,
-                params={'subject': employee.subject_name, 'det_prob_threshold': 0.8},
-                files={'file': ('image.jpg', image_binary, 'image/jpeg')},
-                timeout=30
+            response = compreface_upload(
+                FACES_URL,
+                {'subject': employee.subject_name, 'det_prob_threshold': 0.8},
+                image_stream,
+                'image.jpg'
             )
             
             if response.status_code == 201:
-                result = response.json()
+                result = orjson.loads(response.content)
                 image_id = result.get('image_id')
                 
                 # Store face image reference
@@ -269,7 +526,7 @@ def add_face(employee_id):
                 flash(f'Successfully added face for {employee.full_name}', 'success')
                 return redirect(url_for('employee_details', employee_id=employee.id))
             else:
-                flash('Failed to add face', 'danger')
+                flash(compreface_error_message(response, 'Failed to add face'), 'danger')
                 
         except Exception as e:
             flash(f'Error: {str(e)}', 'danger')
@@ -279,37 +536,47 @@ def add_face(employee_id):
 @app.route('/employee/<int:employee_id>')
 @login_required
 def employee_details(employee_id):
-    employee = Employee.query.get_or_404(employee_id)
+    employee = db.get_or_404(Employee, employee_id)
     
-    # Get attendance logs for current month
-    current_month = datetime.now().month
-    current_year = datetime.now().year
+    # Get attendance logs for the current IST month; this one clock reading
+    # also decides today's ongoing hours below
+    now_ist = get_ist_time()
+    month_start, month_end = month_range(now_ist.year, now_ist.month)
     
-    logs = AttendanceLog.query.filter(
-        AttendanceLog.employee_id == employee_id,
-        extract('month', AttendanceLog.timestamp) == current_month,
-        extract('year', AttendanceLog.timestamp) == current_year
-    ).order_by(AttendanceLog.timestamp.desc()).all()
+    logs = db.session.execute(
+        select(AttendanceLog).where(
+            AttendanceLog.employee_id == employee_id,
+            AttendanceLog.timestamp >= month_start,
+            AttendanceLog.timestamp < month_end
+        ).order_by(AttendanceLog.timestamp.desc())
+    ).scalars().all()
     
-    # Calculate working hours
-    working_days = {}
-    for log in logs:
-        date_key = log.timestamp.date()
-        if date_key not in working_days:
-            working_days[date_key] = {'in': None, 'out': None, 'logs': []}
-        
-        working_days[date_key]['logs'].append(log)
-        
-        if log.log_type == 'IN' and not working_days[date_key]['in']:
-            working_days[date_key]['in'] = log.timestamp
-        elif log.log_type == 'OUT':
-            working_days[date_key]['out'] = log.timestamp
+    # First IN and last OUT per day from the precomputed summaries
+    daily_rows = db.session.execute(
+        select(DailyAttendanceSummary).where(
+            DailyAttendanceSummary.employee_id == employee_id,
+            DailyAttendanceSummary.day >= month_start.date(),
+            DailyAttendanceSummary.day < month_end.date()
+        ).order_by(DailyAttendanceSummary.day.desc())
+    ).scalars().all()
+    
+    working_days = {
+        row.day: {'in': row.first_in, 'out': row.last_out}
+        for row in daily_rows
+    }
+    
+    # Bind the pay settings once for the per-day loops below
+    working_hours = Config.WORKING_HOURS_PER_DAY
+    full_day_hours = Config.MINIMUM_HOURS_FOR_FULL_DAY
+    overtime_multiplier = Config.OVERTIME_MULTIPLIER
+    working_days_per_month = Config.WORKING_DAYS_PER_MONTH
+    incomplete_day_policy = Config.INCOMPLETE_DAY_POLICY
     
     # Calculate total hours and salary with overtime
     total_regular_hours = 0
     total_overtime_hours = 0
     total_days_worked = 0
-    today_ist = get_ist_time().date()
+    today_ist = now_ist.date()
     
     # Detailed calculation for each day
     daily_calculations = {}
@@ -326,13 +593,13 @@ def employee_details(employee_id):
             # Full day with both IN and OUT
             hours_worked = (times['out'] - times['in']).total_seconds() / 3600
             
-            if hours_worked >= Config.WORKING_HOURS_PER_DAY:
+            if hours_worked >= working_hours:
                 # Full day + overtime
-                daily_calc['regular_hours'] = Config.WORKING_HOURS_PER_DAY
-                daily_calc['overtime_hours'] = hours_worked - Config.WORKING_HOURS_PER_DAY
+                daily_calc['regular_hours'] = working_hours
+                daily_calc['overtime_hours'] = hours_worked - working_hours
                 daily_calc['status'] = 'present_ot'
                 total_days_worked += 1
-            elif hours_worked >= Config.MINIMUM_HOURS_FOR_FULL_DAY:
+            elif hours_worked >= full_day_hours:
                 # Full day, no overtime
                 daily_calc['regular_hours'] = hours_worked
                 daily_calc['status'] = 'present'
@@ -351,18 +618,17 @@ def employee_details(employee_id):
             # Only clocked IN
             if day == today_ist:
                 # Today - calculate hours until now
-                now_ist = get_ist_time()
                 in_time_ist = utc_to_ist(times['in'])
                 hours_till_now = (now_ist - in_time_ist).total_seconds() / 3600
                 
-                daily_calc['regular_hours'] = min(hours_till_now, Config.WORKING_HOURS_PER_DAY)
-                if hours_till_now > Config.WORKING_HOURS_PER_DAY:
-                    daily_calc['overtime_hours'] = hours_till_now - Config.WORKING_HOURS_PER_DAY
+                daily_calc['regular_hours'] = min(hours_till_now, working_hours)
+                if hours_till_now > working_hours:
+                    daily_calc['overtime_hours'] = hours_till_now - working_hours
                 daily_calc['total_hours'] = hours_till_now
                 daily_calc['status'] = 'ongoing'
                 
                 # Don't count as full day yet
-                if hours_till_now >= Config.MINIMUM_HOURS_FOR_FULL_DAY:
+                if hours_till_now >= full_day_hours:
                     total_days_worked += 1
                 else:
                     total_days_worked += 0.5
@@ -371,15 +637,15 @@ def employee_details(employee_id):
                 total_overtime_hours += daily_calc['overtime_hours']
             else:
                 # Past date with only IN - based on policy
-                if Config.INCOMPLETE_DAY_POLICY == 'NO_PAY':
+                if incomplete_day_policy == 'NO_PAY':
                     daily_calc['status'] = 'incomplete'
-                elif Config.INCOMPLETE_DAY_POLICY == 'HALF_DAY':
-                    daily_calc['regular_hours'] = Config.WORKING_HOURS_PER_DAY / 2
+                elif incomplete_day_policy == 'HALF_DAY':
+                    daily_calc['regular_hours'] = working_hours / 2
                     daily_calc['status'] = 'half_day'
                     total_days_worked += 0.5
                     total_regular_hours += daily_calc['regular_hours']
-                elif Config.INCOMPLETE_DAY_POLICY == 'FULL_DAY':
-                    daily_calc['regular_hours'] = Config.WORKING_HOURS_PER_DAY
+                elif incomplete_day_policy == 'FULL_DAY':
+                    daily_calc['regular_hours'] = working_hours
                     daily_calc['status'] = 'assumed_full'
                     total_days_worked += 1
                     total_regular_hours += daily_calc['regular_hours']
@@ -387,17 +653,24 @@ def employee_details(employee_id):
         daily_calculations[day] = daily_calc
     
     # Salary calculation with overtime
-    daily_salary = employee.salary / Config.WORKING_DAYS_PER_MONTH
-    hourly_salary = daily_salary / Config.WORKING_HOURS_PER_DAY
+    daily_salary = employee.salary / working_days_per_month
+    hourly_salary = daily_salary / working_hours
     
     # Calculate components
     basic_salary = daily_salary * total_days_worked
-    overtime_pay = total_overtime_hours * (hourly_salary * Config.OVERTIME_MULTIPLIER)
+    overtime_pay = total_overtime_hours * (hourly_salary * overtime_multiplier)
     total_salary = basic_salary + overtime_pay
     
-    # Add daily calculations to working_days for template
+    # Similarity scores per day, so the template need not rescan every log for each day
+    scores_by_day = defaultdict(list)
+    for log in logs:
+        if log.similarity_score:
+            scores_by_day[log.timestamp.date()].append(log.similarity_score)
+    
+    # Add daily calculations and scores to working_days for template
     for day in working_days:
         working_days[day]['calc'] = daily_calculations.get(day, {})
+        working_days[day]['scores'] = scores_by_day.get(day, [])
     
     return render_template('employee_details.html', 
                          employee=employee,
@@ -423,29 +696,50 @@ def attendance():
 @login_required
 def api_clock():
     try:
-        data = request.get_json()
-        image_data = data.get('image')
-        log_type = data.get('type', 'IN')  # IN or OUT
+        image_upload = request.files.get('file')
+        image_data = None
         
-        if not image_data:
+        if image_upload:
+            # Multipart upload - raw JPEG bytes, no base64 step
+            log_type = request.form.get('type', 'IN')  # IN or OUT
+        else:
+            data = request.get_json()
+            image_data = data.get('image')
+            log_type = data.get('type', 'IN')  # IN or OUT
+            
+            if not image_data:
+                return jsonify({'error': 'No image provided'}), 400
+        
+        # Shed repeat presses from this kiosk before spending a CompreFace call.
+        # Kept short since many employees clock in at the same kiosk session;
+        # the per-employee duplicate window is still checked below.
+        last_clock = session.get('last_clock')
+        if (last_clock and last_clock[0] == log_type
+                and time.time() - last_clock[1] < Config.CLOCK_DEBOUNCE_SECONDS):
+            return jsonify({
+                'success': False,
+                'message': 'Please wait a moment before clocking again.'
+            }), 200
+        
+        image_stream, image_size = open_image(image_upload, image_data)
+        
+        if not image_size:
             return jsonify({'error': 'No image provided'}), 400
         
-        # Remove data URL prefix
-        image_data = image_data.split(',')[1]
-        image_binary = base64.b64decode(image_data)
+        if image_size > Config.MAX_IMAGE_BYTES:
+            return jsonify({'error': 'Image too large'}), 413
         
         # Send to CompreFace for recognition
-        response = requests.post(
-            f"{COMPREFACE_BASE_URL}/recognition/recognize",
-            headers=HEADERS,
-            params={'limit': 1, 'det_prob_threshold': 0.8},
-            files={'file': ('face.jpg', image_binary, 'image/jpeg')},
-            timeout=30
+        response = compreface_upload(
+            RECOGNIZE_URL,
+            {'limit': 1, 'det_prob_threshold': 0.8},
+            image_stream,
+            'face.jpg'
         )
         
         if response.status_code == 200:
-            result = response.json()
-            print(f"Recognition result: {json.dumps(result, indent=2)}")
+            result = orjson.loads(response.content)
+            logger.debug("Recognition result: %s", result)
             
             if result.get('result') and len(result['result']) > 0:
                 face = result['result'][0]
@@ -455,7 +749,7 @@ def api_clock():
                     similarity = subject.get('similarity', 0)
                     subject_name = subject.get('subject', '')
                     
-                    print(f"Recognized: {subject_name} with similarity {similarity}")
+                    logger.debug("Recognized: %s with similarity %s", subject_name, similarity)
                     
                     # Check if similarity meets threshold
                     if similarity < Config.SIMILARITY_THRESHOLD:
@@ -465,63 +759,46 @@ def api_clock():
                         }), 200
                     
                     # Find employee by subject name
-                    employee = Employee.query.filter_by(
-                        subject_name=subject_name
-                    ).first()
+                    employee = get_employee_for_subject(subject_name)
                     
                     if not employee:
-                        print(f"Employee not found for subject: {subject_name}")
-                        # Try to find by partial match if exact match fails
-                        all_employees = Employee.query.filter_by(is_active=True).all()
-                        for emp in all_employees:
-                            if emp.subject_name == subject_name:
-                                employee = emp
-                                break
-                        
-                        if not employee:
-                            return jsonify({
-                                'success': False,
-                                'message': f'Employee not found in database for subject: {subject_name}'
-                            }), 200
+                        logger.warning("Employee not found for subject: %s", subject_name)
+                        return jsonify({
+                            'success': False,
+                            'message': f'Employee not found in database for subject: {subject_name}'
+                        }), 200
                     
-                    # Check for recent logs to prevent duplicates
+                    # Create attendance log with current UTC time (will be converted to IST for display),
+                    # skipped if there is a recent log of the same type
                     current_time_utc = datetime.utcnow()
-                    recent_threshold = current_time_utc - timedelta(
-                        minutes=Config.MINIMUM_INTERVAL_MINUTES
-                    )
                     
-                    recent_log = AttendanceLog.query.filter(
-                        AttendanceLog.employee_id == employee.id,
-                        AttendanceLog.timestamp > recent_threshold,
-                        AttendanceLog.log_type == log_type
-                    ).first()
-                    
-                    if recent_log:
+                    if not insert_log_unless_recent(
+                        employee['id'],
+                        log_type,
+                        similarity,
+                        face.get('det_probability', 0.0),
+                        current_time_utc
+                    ):
+                        db.session.rollback()
                         return jsonify({
                             'success': False,
                             'message': f'Already clocked {log_type.lower()} recently. Please wait {Config.MINIMUM_INTERVAL_MINUTES} minutes.'
                         }), 200
                     
-                    # Create attendance log with current UTC time (will be converted to IST for display)
-                    attendance_log = AttendanceLog(
-                        employee_id=employee.id,
-                        log_type=log_type,
-                        similarity_score=similarity,
-                        confidence_score=face.get('det_probability', 0.0),
-                        timestamp=current_time_utc
-                    )
-                    db.session.add(attendance_log)
+                    record_daily_summary(employee['id'], log_type, current_time_utc)
                     db.session.commit()
+                    invalidate_today_summary_cache()
+                    session['last_clock'] = [log_type, time.time()]
                     
                     # Return IST time for display
-                    ist_time = utc_to_ist(attendance_log.timestamp)
+                    ist_time = utc_to_ist(current_time_utc)
                     
                     return jsonify({
                         'success': True,
                         'employee': {
-                            'name': employee.full_name,
-                            'id': employee.employee_id,
-                            'department': employee.department
+                            'name': employee['name'],
+                            'id': employee['employee_id'],
+                            'department': employee['department']
                         },
                         'log_type': log_type,
                         'timestamp': ist_time.strftime('%Y-%m-%d %I:%M:%S %p IST'),
@@ -538,50 +815,66 @@ def api_clock():
                     'message': 'No face detected in the image. Please ensure your face is clearly visible.'
                 }), 200
         else:
-            print(f"CompreFace error: {response.status_code} - {response.text}")
+            logger.warning("CompreFace error: %s", response.status_code)
             return jsonify({'error': f'Recognition failed: {response.text}'}), 400
             
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'Image too large'}), 413
     except Exception as e:
-        print(f"Clock Error: {str(e)}")
+        logger.exception("Clock error")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/reports')
 @login_required
 def reports():
     # Get month and policy from query parameters
-    month_str = request.args.get('month', datetime.now().strftime('%Y-%m'))
+    now_ist = get_ist_time()
+    month_str = request.args.get('month', now_ist.strftime('%Y-%m'))
     policy = request.args.get('policy', 'NO_PAY')  # Default to NO_PAY
     year, month = map(int, month_str.split('-'))
+    month_start, month_end = month_range(year, month)
     
     # Get all employees with their attendance data
     employees_data = []
     
-    employees = Employee.query.filter_by(is_active=True).all()
+    employees = db.session.execute(
+        select(Employee).filter_by(is_active=True).options(
+            load_only(
+                Employee.id, Employee.employee_id, Employee.full_name,
+                Employee.department, Employee.salary
+            )
+        )
+    ).scalars().all()
+    
+    # Bind the pay settings once for the per-day loops below
+    working_hours = Config.WORKING_HOURS_PER_DAY
+    full_day_hours = Config.MINIMUM_HOURS_FOR_FULL_DAY
+    overtime_multiplier = Config.OVERTIME_MULTIPLIER
+    working_days_per_month = Config.WORKING_DAYS_PER_MONTH
+    
+    # The same clock reading for every employee's ongoing day
+    today = now_ist.date()
+    current_time = now_ist
+    
+    # First IN and last OUT per employee per day for the whole month in one query
+    days_by_employee = defaultdict(dict)
+    for employee_id, day, first_in, last_out in db.session.execute(
+        select(
+            DailyAttendanceSummary.employee_id, DailyAttendanceSummary.day,
+            DailyAttendanceSummary.first_in, DailyAttendanceSummary.last_out
+        ).where(
+            DailyAttendanceSummary.day >= month_start.date(),
+            DailyAttendanceSummary.day < month_end.date()
+        ).order_by(DailyAttendanceSummary.day)
+    ):
+        days_by_employee[employee_id][day] = {'in': first_in, 'out': last_out}
     
     for employee in employees:
-        # Get all logs for this month
-        logs = AttendanceLog.query.filter(
-            AttendanceLog.employee_id == employee.id,
-            extract('month', AttendanceLog.timestamp) == month,
-            extract('year', AttendanceLog.timestamp) == year
-        ).order_by(AttendanceLog.timestamp).all()
-        
-        print(f"\nProcessing {employee.full_name} with policy: {policy}")
-        print(f"Found {len(logs)} logs for this month")
+        logger.debug("Processing %s with policy: %s", employee.full_name, policy)
         
-        # Process logs to calculate working days and hours
-        working_days = {}
-        for log in logs:
-            date_key = log.timestamp.date()
-            if date_key not in working_days:
-                working_days[date_key] = {'in': None, 'out': None}
-            
-            if log.log_type == 'IN' and not working_days[date_key]['in']:
-                working_days[date_key]['in'] = log.timestamp
-            elif log.log_type == 'OUT':
-                working_days[date_key]['out'] = log.timestamp
+        working_days = days_by_employee.get(employee.id, {})
         
-        print(f"Working days: {len(working_days)}")
+        logger.debug("Working days: %d", len(working_days))
         
         # Calculate totals with overtime based on selected policy
         total_days = 0
@@ -595,12 +888,12 @@ def reports():
                 hours_worked = (times['out'] - times['in']).total_seconds() / 3600
                 total_actual_hours += hours_worked
                 
-                if hours_worked >= Config.WORKING_HOURS_PER_DAY:
+                if hours_worked >= working_hours:
                     # Full day + overtime
-                    regular_hours = Config.WORKING_HOURS_PER_DAY
-                    overtime_hours = hours_worked - Config.WORKING_HOURS_PER_DAY
+                    regular_hours = working_hours
+                    overtime_hours = hours_worked - working_hours
                     total_days += 1
-                elif hours_worked >= Config.MINIMUM_HOURS_FOR_FULL_DAY:
+                elif hours_worked >= full_day_hours:
                     # Full day, no overtime
                     regular_hours = hours_worked
                     overtime_hours = 0
@@ -610,7 +903,7 @@ def reports():
                     if policy == 'ACTUAL_HOURS':
                         regular_hours = hours_worked
                         overtime_hours = 0
-                        total_days += hours_worked / Config.WORKING_HOURS_PER_DAY
+                        total_days += hours_worked / working_hours
                     else:
                         regular_hours = hours_worked
                         overtime_hours = 0
@@ -621,18 +914,17 @@ def reports():
                 
             elif times['in'] and not times['out']:
                 # Incomplete day
-                if day == date.today():
+                if day == today:
                     # Today - calculate hours until now
-                    current_time = get_ist_time()
                     in_time_ist = utc_to_ist(times['in'])
                     hours_till_now = (current_time - in_time_ist).total_seconds() / 3600
                     total_actual_hours += hours_till_now
-                    regular_hours = min(hours_till_now, Config.WORKING_HOURS_PER_DAY)
-                    overtime_hours = max(0, hours_till_now - Config.WORKING_HOURS_PER_DAY)
+                    regular_hours = min(hours_till_now, working_hours)
+                    overtime_hours = max(0, hours_till_now - working_hours)
                     
                     if policy == 'ACTUAL_HOURS':
-                        total_days += hours_till_now / Config.WORKING_HOURS_PER_DAY
-                    elif hours_till_now >= Config.MINIMUM_HOURS_FOR_FULL_DAY:
+                        total_days += hours_till_now / working_hours
+                    elif hours_till_now >= full_day_hours:
                         total_days += 1
                     else:
                         total_days += 0.5
@@ -641,49 +933,48 @@ def reports():
                     total_overtime_hours += overtime_hours
                 else:
                     # Past day with only IN - apply selected policy
-                    print(f"  Incomplete day {day}: applying policy {policy}")
+                    logger.debug("Incomplete day %s: applying policy %s", day, policy)
                     
                     if policy == 'NO_PAY':
                         # No payment for incomplete days
-                        print(f"    NO_PAY: No hours/days added")
-                        pass
+                        logger.debug("NO_PAY: No hours/days added")
                     elif policy == 'HALF_DAY':
-                        total_regular_hours += Config.WORKING_HOURS_PER_DAY / 2
+                        total_regular_hours += working_hours / 2
                         total_days += 0.5
-                        print(f"    HALF_DAY: Added 4 hours and 0.5 days")
+                        logger.debug("HALF_DAY: Added 4 hours and 0.5 days")
                     elif policy == 'FULL_DAY':
-                        total_regular_hours += Config.WORKING_HOURS_PER_DAY
+                        total_regular_hours += working_hours
                         total_days += 1
-                        print(f"    FULL_DAY: Added 8 hours and 1 day")
+                        logger.debug("FULL_DAY: Added 8 hours and 1 day")
                     elif policy == 'ACTUAL_HOURS':
                         # Assume minimum hours for past incomplete days
                         assumed_hours = 4  # Assume 4 hours if no clock out
                         total_regular_hours += assumed_hours
                         total_actual_hours += assumed_hours
-                        total_days += assumed_hours / Config.WORKING_HOURS_PER_DAY
-                        print(f"    ACTUAL_HOURS: Added {assumed_hours} hours")
+                        total_days += assumed_hours / working_hours
+                        logger.debug("ACTUAL_HOURS: Added %s hours", assumed_hours)
         
         # Calculate salary based on selected policy
-        daily_salary = employee.salary / Config.WORKING_DAYS_PER_MONTH
-        hourly_salary = daily_salary / Config.WORKING_HOURS_PER_DAY
+        daily_salary = employee.salary / working_days_per_month
+        hourly_salary = daily_salary / working_hours
         
         if policy == 'ACTUAL_HOURS':
             # Pay based on actual hours worked
             basic_salary = total_regular_hours * hourly_salary
-            overtime_pay = total_overtime_hours * (hourly_salary * Config.OVERTIME_MULTIPLIER)
-            print(f"\nACTUAL_HOURS calculation:")
-            print(f"  Regular hours: {total_regular_hours} × ₹{hourly_salary:.2f} = ₹{basic_salary:.2f}")
+            overtime_pay = total_overtime_hours * (hourly_salary * overtime_multiplier)
+            logger.debug("ACTUAL_HOURS: %s regular hrs × ₹%.2f = ₹%.2f",
+                         total_regular_hours, hourly_salary, basic_salary)
         else:
             # Pay based on days worked
             basic_salary = daily_salary * total_days
-            overtime_pay = total_overtime_hours * (hourly_salary * Config.OVERTIME_MULTIPLIER)
-            print(f"\n{policy} calculation:")
-            print(f"  Days worked: {total_days} × ₹{daily_salary:.2f} = ₹{basic_salary:.2f}")
+            overtime_pay = total_overtime_hours * (hourly_salary * overtime_multiplier)
+            logger.debug("%s: %s days × ₹%.2f = ₹%.2f",
+                         policy, total_days, daily_salary, basic_salary)
         
         total_salary = basic_salary + overtime_pay
         
-        print(f"  Overtime: {total_overtime_hours} hrs × ₹{hourly_salary * Config.OVERTIME_MULTIPLIER:.2f} = ₹{overtime_pay:.2f}")
-        print(f"  Total salary: ₹{total_salary:.2f}")
+        logger.debug("Overtime: %s hrs = ₹%.2f, total salary: ₹%.2f",
+                     total_overtime_hours, overtime_pay, total_salary)
         
         employees_data.append({
             'employee': employee,
@@ -705,16 +996,19 @@ def reports():
 @login_required
 def delete_employee(employee_id):
     try:
-        employee = Employee.query.get_or_404(employee_id)
+        employee = db.get_or_404(Employee, employee_id)
         
         # Delete from CompreFace
-        response = requests.delete(
-            f"{COMPREFACE_BASE_URL}/recognition/subjects/{employee.subject_name}",
-            headers=HEADERS,
+        response = compreface_request(
+            'DELETE',
+            SUBJECT_URL.format(employee.subject_name),
             timeout=10
         )
         
         if response.status_code == 200:
+            invalidate_subjects_cache()
+            forget_employee_for_subject(employee.subject_name)
+            
             # Soft delete - just mark as inactive
             employee.is_active = False
             db.session.commit()
@@ -723,7 +1017,7 @@ def delete_employee(employee_id):
             return jsonify({'error': 'Failed to delete from recognition system'}), 400
             
     except Exception as e:
-        print(f"Delete Error: {str(e)}")
+        logger.exception("Delete error for employee %s", employee_id)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/debug/subjects')
@@ -731,18 +1025,12 @@ def delete_employee(employee_id):
 def debug_subjects():
     try:
         # Get subjects from CompreFace
-        response = requests.get(
-            f"{COMPREFACE_BASE_URL}/recognition/subjects",
-            headers=HEADERS,
-            timeout=10
-        )
-        
-        compreface_subjects = []
-        if response.status_code == 200:
-            compreface_subjects = response.json().get('subjects', [])
+        compreface_subjects = get_compreface_subjects()
         
         # Get employees from database
-        db_employees = Employee.query.filter_by(is_active=True).all()
+        db_employees = db.session.execute(
+            select(Employee).filter_by(is_active=True)
+        ).scalars().all()
         
         return jsonify({
             'compreface_subjects': compreface_subjects,
@@ -759,4 +1047,6 @@ def debug_subjects():
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5999, threaded=True)
\ No newline at end of file
+    # Production WSGI server with a bounded thread pool; no debugger/reloader
+    from waitress import serve
+    serve(app, host='0.0.0.0', port=5999, threads=16, connection_limit=1000)
\ No newline at end of file
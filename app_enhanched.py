@@ -1,18 +1,21 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-import requests
-import base64
-import json
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+import orjson
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.security import check_password_hash, generate_password_hash
 from config import Config
-from models import db, Employee, AttendanceLog, FaceImage
+from models import db, Employee, AttendanceLog, FaceImage, record_daily_summary
+from utils import ORJSONProvider, StreamBody, SESSION, COMPREFACE_BASE_URL, base64_payload, get_ist_time, utc_to_ist, ist_day_bounds_utc, month_range
 from datetime import datetime, timedelta, date
-from sqlalchemy import func, and_, extract
+from sqlalchemy import func, and_, select
+from collections import defaultdict
 import uuid
-import pytz
+import threading
 
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = ORJSONProvider(app)
 
 # Initialize extensions
 db.init_app(app)
@@ -24,26 +27,8 @@ login_manager.login_view = 'login'
 with app.app_context():
     db.create_all()
 
-# Timezone helper functions
-def get_ist_time():
-    """Get current time in IST"""
-    return datetime.now(Config.TIMEZONE)
-
-def utc_to_ist(utc_dt):
-    """Convert UTC datetime to IST"""
-    if utc_dt is None:
-        return None
-    if utc_dt.tzinfo is None:
-        utc_dt = pytz.UTC.localize(utc_dt)
-    return utc_dt.astimezone(Config.TIMEZONE)
-
-def ist_to_utc(ist_dt):
-    """Convert IST datetime to UTC for database storage"""
-    if ist_dt is None:
-        return None
-    if ist_dt.tzinfo is None:
-        ist_dt = Config.TIMEZONE.localize(ist_dt)
-    return ist_dt.astimezone(pytz.UTC).replace(tzinfo=None)
+# Window in which a second log of the same type counts as a duplicate
+RECENT_LOG_WINDOW = timedelta(minutes=Config.MINIMUM_INTERVAL_MINUTES)
 
 # Add timezone filter for templates
 @app.template_filter('to_ist')
@@ -72,11 +57,62 @@ def load_user(user_id):
         return User(user_id)
     return None
 
-# CompreFace API endpoints
-COMPREFACE_BASE_URL = f"{Config.COMPREFACE_URL}/api/v1"
-HEADERS = {
-    'x-api-key': Config.COMPREFACE_API_KEY
-}
+def post_image(url, params, image_upload, image_data, filename, timeout=30):
+    """POST an image to CompreFace: uploaded files as multipart, base64 as JSON"""
+    if image_upload:
+        # Stream the upload instead of letting requests build the body in memory
+        encoder = MultipartEncoder(
+            fields={'file': (filename, StreamBody(image_upload.stream), 'image/jpeg')}
+        )
+        return SESSION.post(
+            url,
+            params=params,
+            data=encoder,
+            headers={'Content-Type': encoder.content_type},
+            timeout=timeout
+        )
+    # CompreFace takes base64 directly, so skip decoding and multipart encoding
+    payload = base64_payload(image_data)
+    if len(payload) * 3 // 4 > Config.MAX_IMAGE_BYTES:
+        raise RequestEntityTooLarge()
+    return SESSION.post(
+        url,
+        params=params,
+        data=orjson.dumps({'file': payload}),
+        headers={'Content-Type': 'application/json'},
+        timeout=timeout
+    )
+
+# CompreFace subject name -> the Employee fields api_clock needs
+_employee_by_subject = {}
+_employee_by_subject_lock = threading.Lock()
+
+def get_employee_for_subject(subject_name):
+    """Look up the employee enrolled as a CompreFace subject, caching the result"""
+    employee = _employee_by_subject.get(subject_name)
+    if employee is None:
+        # Only the displayed columns; no need to hydrate a full Employee
+        record = db.session.execute(
+            select(Employee.id, Employee.full_name, Employee.employee_id, Employee.department)
+            .filter_by(subject_name=subject_name)
+            .limit(1)
+        ).first()
+        if record is None:
+            return None
+        employee = {
+            'id': record.id,
+            'name': record.full_name,
+            'employee_id': record.employee_id,
+            'department': record.department
+        }
+        with _employee_by_subject_lock:
+            employee = _employee_by_subject.setdefault(subject_name, employee)
+    return employee
+
+def forget_employee_for_subject(subject_name):
+    """Drop a cached subject lookup after the employee is added or deleted"""
+    with _employee_by_subject_lock:
+        _employee_by_subject.pop(subject_name, None)
 
 # Routes
 @app.route('/')
@@ -113,12 +149,13 @@ def logout():
 @login_required
 def dashboard():
     # Get all employees from database
-    employees = Employee.query.filter_by(is_active=True).all()
+    employees = db.session.execute(
+        select(Employee).filter_by(is_active=True)
+    ).scalars().all()
     
     # Get today's attendance summary in IST
     today_ist = get_ist_time().date()
-    today_start_utc = ist_to_utc(datetime.combine(today_ist, datetime.min.time()))
-    today_end_utc = ist_to_utc(datetime.combine(today_ist, datetime.max.time()))
+    today_start_utc, today_end_utc = ist_day_bounds_utc(today_ist)
     
     attendance_summary = db.session.query(
         Employee.full_name,
@@ -148,6 +185,7 @@ def add_employee():
         designation = request.form.get('designation')
         date_joined = datetime.strptime(request.form.get('date_joined'), '%Y-%m-%d').date()
         salary = float(request.form.get('salary', 0))
+        image_upload = request.files.get('file')
         image_data = request.form.get('image_data')
         
         # Generate subject name for CompreFace
@@ -155,70 +193,74 @@ def add_employee():
         
         print(f"Creating employee with subject name: {subject_name}")  # Debug log
         
-        if not image_data:
+        if not image_upload and not image_data:
             flash('Please capture at least one photo', 'danger')
             return render_template('add_employee.html')
         
         try:
             # Check if employee already exists
-            existing = Employee.query.filter(
-                (Employee.employee_id == employee_id) | 
-                (Employee.email == email)
+            existing = db.session.execute(
+                select(Employee.id).where(
+                    (Employee.employee_id == employee_id) | 
+                    (Employee.email == email)
+                ).limit(1)
             ).first()
             
             if existing:
                 flash('Employee with this ID or email already exists', 'danger')
                 return render_template('add_employee.html')
             
-            # Create employee record
-            employee = Employee(
-                subject_name=subject_name,
-                employee_id=employee_id,
-                full_name=full_name,
-                email=email,
-                phone=phone,
-                department=department,
-                designation=designation,
-                date_joined=date_joined,
-                salary=salary
-            )
-            db.session.add(employee)
-            db.session.flush()  # Get the ID without committing
-            
-            # Process and add face to CompreFace
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            image_binary = base64.b64decode(image_data)
-            
-            # Add face to CompreFace
-            response = requests.post(
+            # Add face to CompreFace first so no transaction is open during the call
+            response = post_image(
                 f"{COMPREFACE_BASE_URL}/recognition/faces",
-                headers=HEADERS,
-                params={'subject': subject_name, 'det_prob_threshold': 0.8},
-                files={'file': ('image.jpg', image_binary, 'image/jpeg')},
-                timeout=30
+                {'subject': subject_name, 'det_prob_threshold': 0.8},
+                image_upload,
+                image_data,
+                'image.jpg'
             )
             
             if response.status_code == 201:
-                result = response.json()
+                result = orjson.loads(response.content)
                 image_id = result.get('image_id')
                 
-                # Store face image reference
-                face_image = FaceImage(
-                    employee_id=employee.id,
+                # Create employee record and face image reference together
+                employee = Employee(
+                    subject_name=subject_name,
+                    employee_id=employee_id,
+                    full_name=full_name,
+                    email=email,
+                    phone=phone,
+                    department=department,
+                    designation=designation,
+                    date_joined=date_joined,
+                    salary=salary
+                )
+                employee.face_images.append(FaceImage(
                     image_id=image_id,
                     is_primary=True
-                )
-                db.session.add(face_image)
-                db.session.commit()
+                ))
+                db.session.add(employee)
+                
+                try:
+                    db.session.commit()
+                except Exception:
+                    # Undo the CompreFace side since the employee was not saved
+                    db.session.rollback()
+                    SESSION.delete(
+                        f"{COMPREFACE_BASE_URL}/recognition/faces/{image_id}",
+                        timeout=10
+                    )
+                    raise
                 
+                forget_employee_for_subject(subject_name)
                 flash(f'Successfully added employee: {full_name}', 'success')
                 return redirect(url_for('dashboard'))
             else:
                 db.session.rollback()
                 flash(f'Failed to add face to recognition system', 'danger')
                 
+        except RequestEntityTooLarge:
+            flash('Photo is too large. Please retake it.', 'danger')
         except Exception as e:
             db.session.rollback()
             flash(f'Error adding employee: {str(e)}', 'danger')
@@ -229,32 +271,28 @@ def add_employee():
 @app.route('/add_face/<int:employee_id>', methods=['GET', 'POST'])
 @login_required
 def add_face(employee_id):
-    employee = Employee.query.get_or_404(employee_id)
+    employee = db.get_or_404(Employee, employee_id)
     
     if request.method == 'POST':
+        image_upload = request.files.get('file')
         image_data = request.form.get('image_data')
         
-        if not image_data:
+        if not image_upload and not image_data:
             flash('Please capture a photo', 'danger')
             return render_template('add_face.html', employee=employee)
         
         try:
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            image_binary = base64.b64decode(image_data)
-            
             # Add additional face to CompreFace
-            response = requests.post(
+            response = post_image(
                 f"{COMPREFACE_BASE_URL}/recognition/faces",
-                headers=HEADERS,
-                params={'subject': employee.subject_name, 'det_prob_threshold': 0.8},
-                files={'file': ('image.jpg', image_binary, 'image/jpeg')},
-                timeout=30
+                {'subject': employee.subject_name, 'det_prob_threshold': 0.8},
+                image_upload,
+                image_data,
+                'image.jpg'
             )
             
             if response.status_code == 201:
-                result = response.json()
+                result = orjson.loads(response.content)
                 image_id = result.get('image_id')
                 
                 # Store face image reference
@@ -271,6 +309,8 @@ def add_face(employee_id):
             else:
                 flash('Failed to add face', 'danger')
                 
+        except RequestEntityTooLarge:
+            flash('Photo is too large. Please retake it.', 'danger')
         except Exception as e:
             flash(f'Error: {str(e)}', 'danger')
     
@@ -279,26 +319,31 @@ def add_face(employee_id):
 @app.route('/employee/<int:employee_id>')
 @login_required
 def employee_details(employee_id):
-    employee = Employee.query.get_or_404(employee_id)
+    employee = db.get_or_404(Employee, employee_id)
     
     # Get attendance logs for current month
-    current_month = datetime.now().month
-    current_year = datetime.now().year
+    now = datetime.now()
+    month_start, month_end = month_range(now.year, now.month)
     
-    logs = AttendanceLog.query.filter(
-        AttendanceLog.employee_id == employee_id,
-        extract('month', AttendanceLog.timestamp) == current_month,
-        extract('year', AttendanceLog.timestamp) == current_year
-    ).order_by(AttendanceLog.timestamp.desc()).all()
+    logs = db.session.execute(
+        select(AttendanceLog).where(
+            AttendanceLog.employee_id == employee_id,
+            AttendanceLog.timestamp >= month_start,
+            AttendanceLog.timestamp < month_end
+        ).order_by(AttendanceLog.timestamp.desc())
+    ).scalars().all()
     
     # Calculate working hours
     working_days = {}
     for log in logs:
         date_key = log.timestamp.date()
         if date_key not in working_days:
-            working_days[date_key] = {'in': None, 'out': None, 'logs': []}
+            working_days[date_key] = {'in': None, 'out': None, 'logs': [], 'scores': []}
         
         working_days[date_key]['logs'].append(log)
+        # Similarity scores per day for the template's confidence column
+        if log.similarity_score:
+            working_days[date_key]['scores'].append(log.similarity_score)
         
         if log.log_type == 'IN' and not working_days[date_key]['in']:
             working_days[date_key]['in'] = log.timestamp
@@ -426,29 +471,32 @@ def attendance():
 @login_required
 def api_clock():
     try:
-        data = request.get_json()
-        image_data = data.get('image')
-        log_type = data.get('type', 'IN')  # IN or OUT
-        
-        if not image_data:
-            return jsonify({'error': 'No image provided'}), 400
+        image_upload = request.files.get('file')
+        image_data = None
         
-        # Remove data URL prefix
-        image_data = image_data.split(',')[1]
-        image_binary = base64.b64decode(image_data)
+        if image_upload:
+            log_type = request.form.get('type', 'IN')  # IN or OUT
+        else:
+            data = request.get_json()
+            image_data = data.get('image')
+            log_type = data.get('type', 'IN')  # IN or OUT
+            
+            if not image_data:
+                return jsonify({'error': 'No image provided'}), 400
         
         # Send to CompreFace for recognition
-        response = requests.post(
+        response = post_image(
             f"{COMPREFACE_BASE_URL}/recognition/recognize",
-            headers=HEADERS,
-            params={'limit': 1, 'det_prob_threshold': 0.8},
-            files={'file': ('face.jpg', image_binary, 'image/jpeg')},
-            timeout=30
+            {'limit': 1, 'det_prob_threshold': 0.8},
+            image_upload,
+            image_data,
+            'face.jpg'
         )
         
         if response.status_code == 200:
-            result = response.json()
-            print(f"Recognition result: {json.dumps(result, indent=2)}")
+            result = orjson.loads(response.content)
+            if app.debug:
+                print(f"Recognition result: {orjson.dumps(result, option=orjson.OPT_INDENT_2).decode()}")
             
             if result.get('result') and len(result['result']) > 0:
                 face = result['result'][0]
@@ -468,35 +516,25 @@ def api_clock():
                         }), 200
                     
                     # Find employee by subject name
-                    employee = Employee.query.filter_by(
-                        subject_name=subject_name
-                    ).first()
+                    employee = get_employee_for_subject(subject_name)
                     
                     if not employee:
                         print(f"Employee not found for subject: {subject_name}")
-                        # Try to find by partial match if exact match fails
-                        all_employees = Employee.query.filter_by(is_active=True).all()
-                        for emp in all_employees:
-                            if emp.subject_name == subject_name:
-                                employee = emp
-                                break
-                        
-                        if not employee:
-                            return jsonify({
-                                'success': False,
-                                'message': f'Employee not found in database for subject: {subject_name}'
-                            }), 200
+                        return jsonify({
+                            'success': False,
+                            'message': f'Employee not found in database for subject: {subject_name}'
+                        }), 200
                     
                     # Check for recent logs to prevent duplicates
                     current_time_utc = datetime.utcnow()
-                    recent_threshold = current_time_utc - timedelta(
-                        minutes=Config.MINIMUM_INTERVAL_MINUTES
-                    )
+                    recent_threshold = current_time_utc - RECENT_LOG_WINDOW
                     
-                    recent_log = AttendanceLog.query.filter(
-                        AttendanceLog.employee_id == employee.id,
-                        AttendanceLog.timestamp > recent_threshold,
-                        AttendanceLog.log_type == log_type
+                    recent_log = db.session.execute(
+                        select(AttendanceLog.id).where(
+                            AttendanceLog.employee_id == employee['id'],
+                            AttendanceLog.timestamp > recent_threshold,
+                            AttendanceLog.log_type == log_type
+                        ).limit(1)
                     ).first()
                     
                     if recent_log:
@@ -507,13 +545,15 @@ def api_clock():
                     
                     # Create attendance log with current UTC time (will be converted to IST for display)
                     attendance_log = AttendanceLog(
-                        employee_id=employee.id,
+                        employee_id=employee['id'],
                         log_type=log_type,
                         similarity_score=similarity,
                         confidence_score=face.get('det_probability', 0.0),
                         timestamp=current_time_utc
                     )
                     db.session.add(attendance_log)
+                    # Keep the reports/payroll summary in step with app.py's clock
+                    record_daily_summary(employee['id'], log_type, current_time_utc)
                     db.session.commit()
                     
                     # Return IST time for display
@@ -522,9 +562,9 @@ def api_clock():
                     return jsonify({
                         'success': True,
                         'employee': {
-                            'name': employee.full_name,
-                            'id': employee.employee_id,
-                            'department': employee.department
+                            'name': employee['name'],
+                            'id': employee['employee_id'],
+                            'department': employee['department']
                         },
                         'log_type': log_type,
                         'timestamp': ist_time.strftime('%Y-%m-%d %I:%M:%S %p IST'),
@@ -544,6 +584,8 @@ def api_clock():
             print(f"CompreFace error: {response.status_code} - {response.text}")
             return jsonify({'error': f'Recognition failed: {response.text}'}), 400
             
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'Image too large'}), 413
     except Exception as e:
         print(f"Clock Error: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -566,15 +608,27 @@ def reports():
     # Get all employees with their attendance data
     employees_data = []
     
-    employees = Employee.query.filter_by(is_active=True).all()
+    employees = db.session.execute(
+        select(Employee).filter_by(is_active=True)
+    ).scalars().all()
+    
+    # All logs for this month in one query, bucketed per employee. A timestamp
+    # range (rather than extract()) lets the database use the timestamp index.
+    month_start, month_end = month_range(year, month)
+    # Only the columns the day grouping reads, as plain rows rather than ORM instances
+    logs_by_employee = defaultdict(list)
+    for log in db.session.execute(
+        select(
+            AttendanceLog.employee_id, AttendanceLog.timestamp, AttendanceLog.log_type
+        ).where(
+            AttendanceLog.timestamp >= month_start,
+            AttendanceLog.timestamp < month_end
+        ).order_by(AttendanceLog.employee_id, AttendanceLog.timestamp)
+    ):
+        logs_by_employee[log.employee_id].append(log)
     
     for employee in employees:
-        # Get all logs for this month
-        logs = AttendanceLog.query.filter(
-            AttendanceLog.employee_id == employee.id,
-            extract('month', AttendanceLog.timestamp) == month,
-            extract('year', AttendanceLog.timestamp) == year
-        ).order_by(AttendanceLog.timestamp).all()
+        logs = logs_by_employee.get(employee.id, [])
         
         print(f"\nProcessing {employee.full_name} with policy: {policy}")
         print(f"Found {len(logs)} logs for this month")
@@ -769,12 +823,11 @@ def reports():
 @login_required
 def delete_employee(employee_id):
     try:
-        employee = Employee.query.get_or_404(employee_id)
+        employee = db.get_or_404(Employee, employee_id)
         
         # Delete from CompreFace
-        response = requests.delete(
+        response = SESSION.delete(
             f"{COMPREFACE_BASE_URL}/recognition/subjects/{employee.subject_name}",
-            headers=HEADERS,
             timeout=10
         )
         
@@ -782,6 +835,7 @@ def delete_employee(employee_id):
             # Soft delete - just mark as inactive
             employee.is_active = False
             db.session.commit()
+            forget_employee_for_subject(employee.subject_name)
             return jsonify({'success': True})
         else:
             return jsonify({'error': 'Failed to delete from recognition system'}), 400
@@ -795,18 +849,19 @@ def delete_employee(employee_id):
 def debug_subjects():
     try:
         # Get subjects from CompreFace
-        response = requests.get(
+        response = SESSION.get(
             f"{COMPREFACE_BASE_URL}/recognition/subjects",
-            headers=HEADERS,
             timeout=10
         )
         
         compreface_subjects = []
         if response.status_code == 200:
-            compreface_subjects = response.json().get('subjects', [])
+            compreface_subjects = orjson.loads(response.content).get('subjects', [])
         
         # Get employees from database
-        db_employees = Employee.query.filter_by(is_active=True).all()
+        db_employees = db.session.execute(
+            select(Employee).filter_by(is_active=True)
+        ).scalars().all()
         
         return jsonify({
             'compreface_subjects': compreface_subjects,
@@ -823,4 +878,6 @@ def debug_subjects():
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5999, threaded=True)
\ No newline at end of file
+    # Production WSGI server with a bounded thread pool; no debugger/reloader
+    from waitress import serve
+    serve(app, host='0.0.0.0', port=5999, threads=16, connection_limit=1000)
\ No newline at end of file
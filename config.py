@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-import pytz
+from zoneinfo import ZoneInfo
 
 load_dotenv()
 
@@ -8,13 +8,17 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-here'
     COMPREFACE_URL = os.environ.get('COMPREFACE_URL') or 'http://69.62.73.201:8000'
     COMPREFACE_API_KEY = os.environ.get('COMPREFACE_API_KEY') or 'your-api-key-here'
+    COMPREFACE_MAX_CONCURRENCY = 4  # Maximum simultaneous requests to CompreFace
     
     # Database configuration
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///face_recognition.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Logging
+    LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
+    
     # Timezone configuration
-    TIMEZONE = pytz.timezone('Asia/Kolkata')  # Indian Standard Time
+    TIMEZONE = ZoneInfo('Asia/Kolkata')  # Indian Standard Time
     
     # Simple user store (in production, use a database)
     USERS = {
@@ -24,8 +28,13 @@ class Config:
     
     # Attendance settings
     MINIMUM_INTERVAL_MINUTES = 30  # Minimum time between punch in/out
+    CLOCK_DEBOUNCE_SECONDS = 3  # Ignore repeat clock presses from the same kiosk
     WORKING_HOURS_PER_DAY = 8
     SIMILARITY_THRESHOLD = 0.97  # Minimum similarity for recognition
+    MAX_IMAGE_BYTES = 2_000_000  # Reject captured images larger than this
+    MAX_CONTENT_LENGTH = 6 * 1024 * 1024  # Flask rejects larger request bodies with 413
+    SUBJECTS_CACHE_SECONDS = 15  # How long to cache the CompreFace subject list
+    TODAY_SUMMARY_CACHE_SECONDS = 60  # How long to cache the dashboard's attendance summary
     
     # Salary calculation settings
     WORKING_DAYS_PER_MONTH = 26  # Changed from 22 to 26
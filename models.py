@@ -1,7 +1,24 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case, event, func
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.engine import Engine
 from datetime import datetime
+import sqlite3
 
-db = SQLAlchemy()
+# Keep committed instances loaded so views can read them without another SELECT
+db = SQLAlchemy(session_options={'expire_on_commit': False})
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune SQLite for concurrent kiosk writes: WAL readers don't block the writer"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')  # fsync at checkpoints, not every commit
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA mmap_size=268435456')
+        cursor.execute('PRAGMA busy_timeout=5000')
+        cursor.close()
 
 class Employee(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -17,10 +34,20 @@ class Employee(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # Relationship with attendance logs
-    attendance_logs = db.relationship('AttendanceLog', backref='employee', lazy=True)
+    # Relationships with attendance logs and face images
+    attendance_logs = db.relationship('AttendanceLog', backref='employee', lazy=True,
+                                      cascade='all, delete-orphan')
+    face_images = db.relationship('FaceImage', backref='employee', lazy=True,
+                                  cascade='all, delete-orphan')
 
 class AttendanceLog(db.Model):
+    __table_args__ = (
+        # Covers per-employee range scans (reports, duplicate clock check)
+        db.Index('ix_att_emp_ts_type', 'employee_id', 'timestamp', 'log_type'),
+        # Day-range scans across all employees (dashboard)
+        db.Index('ix_att_ts', 'timestamp'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employee.id'), nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -29,11 +56,66 @@ class AttendanceLog(db.Model):
     confidence_score = db.Column(db.Float)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class DailyAttendanceSummary(db.Model):
+    # First IN / last OUT per employee per day, kept up to date by api_clock
+    __table_args__ = (
+        db.UniqueConstraint('employee_id', 'day', name='uq_daily_summary_emp_day'),
+        db.Index('ix_daily_summary_day', 'day'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    employee_id = db.Column(db.Integer, db.ForeignKey('employee.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)  # UTC date of the logs
+    first_in = db.Column(db.DateTime)
+    last_out = db.Column(db.DateTime)
+
 class FaceImage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employee.id'), nullable=False)
     image_id = db.Column(db.String(100), unique=True, nullable=False)  # CompreFace image ID
     is_primary = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    
-    employee = db.relationship('Employee', backref='face_images')
\ No newline at end of file
+
+# INSERT constructs that can merge into an existing row, by dialect name
+UPSERT_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+    'mysql': mysql.insert,
+    'mariadb': mysql.insert,
+}
+
+def upsert(model):
+    """INSERT for the bound database's dialect that on_conflict_update() can extend"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect not in UPSERT_INSERTS:
+        raise NotImplementedError(f'Upserts are not supported on {dialect} databases')
+    return UPSERT_INSERTS[dialect](model)
+
+def on_conflict_update(stmt, index_elements, update):
+    """Merge into the row that index_elements already match; update(new) gives the SET values"""
+    if isinstance(stmt, mysql.Insert):
+        # MySQL has no conflict target: any unique key triggers the update
+        return stmt.on_duplicate_key_update(update(stmt.inserted))
+    return stmt.on_conflict_do_update(index_elements=index_elements, set_=update(stmt.excluded))
+
+def record_daily_summary(employee_id, log_type, timestamp):
+    """Fold a new attendance log into its day's summary row (caller commits)"""
+    stmt = upsert(DailyAttendanceSummary).values(
+        employee_id=employee_id,
+        day=timestamp.date(),
+        first_in=timestamp if log_type == 'IN' else None,
+        last_out=timestamp if log_type == 'OUT' else None
+    )
+    summary = DailyAttendanceSummary.__table__.c
+    # One atomic statement, so concurrent first punches of a day can't both insert.
+    # Keep the earliest IN and latest OUT; a NULL on either side keeps the other.
+    db.session.execute(on_conflict_update(stmt, ['employee_id', 'day'], lambda new: {
+        'first_in': case(
+            (new.first_in < summary.first_in, new.first_in),
+            else_=func.coalesce(summary.first_in, new.first_in)
+        ),
+        'last_out': case(
+            (new.last_out > summary.last_out, new.last_out),
+            else_=func.coalesce(summary.last_out, new.last_out)
+        )
+    }))
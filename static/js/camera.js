@@ -3,7 +3,7 @@ const video = document.getElementById('video');
 const canvas = document.getElementById('canvas');
 const ctx = canvas.getContext('2d');
 const captureBtn = document.getElementById('captureBtn');
-const imageDataInput = document.getElementById('imageData');
+const imageFileInput = document.getElementById('imageFile');
 const preview = document.getElementById('preview');
 const capturedImage = document.getElementById('capturedImage');
 const submitBtn = document.getElementById('submitBtn');
@@ -19,6 +19,9 @@ let useDigitalZoom = false;
 let faceDetectionInterval = null;
 let permissionDenied = false;
 
+// Longest side of the uploaded photo; CompreFace does not need more
+const MAX_CAPTURE_SIZE = 800;
+
 // Update camera status display
 function updateCameraStatus(status, message, type = 'info') {
     if (cameraStatus) {
@@ -456,8 +459,10 @@ function startFaceDetection() {
 // Capture photo
 captureBtn.addEventListener('click', () => {
     if (video.videoWidth && video.videoHeight) {
-        canvas.width = video.videoWidth;
-        canvas.height = video.videoHeight;
+        // Downscale so the longest side is at most MAX_CAPTURE_SIZE
+        const scale = Math.min(1, MAX_CAPTURE_SIZE / Math.max(video.videoWidth, video.videoHeight));
+        canvas.width = Math.round(video.videoWidth * scale);
+        canvas.height = Math.round(video.videoHeight * scale);
         
         ctx.clearRect(0, 0, canvas.width, canvas.height);
         
@@ -470,17 +475,21 @@ captureBtn.addEventListener('click', () => {
             
             ctx.drawImage(video, sx, sy, sw, sh, 0, 0, canvas.width, canvas.height);
         } else {
-            ctx.drawImage(video, 0, 0);
+            ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
         }
         
-        const imageData = canvas.toDataURL('image/jpeg', 0.95);
-        
-        console.log('Image captured with zoom:', currentZoom);
-        
-        imageDataInput.value = imageData;
-        capturedImage.src = imageData;
-        preview.style.display = 'block';
-        submitBtn.disabled = false;
+        // Attach the JPEG as a file so the form posts raw bytes, not base64
+        canvas.toBlob((blob) => {
+            console.log('Image captured with zoom:', currentZoom);
+            
+            const transfer = new DataTransfer();
+            transfer.items.add(new File([blob], 'image.jpg', { type: 'image/jpeg' }));
+            imageFileInput.files = transfer.files;
+            
+            capturedImage.src = URL.createObjectURL(blob);
+            preview.style.display = 'block';
+            submitBtn.disabled = false;
+        }, 'image/jpeg', 0.9);
     } else {
         alert('Please wait for camera to initialize');
     }
@@ -501,7 +510,7 @@ const form = subjectForm || employeeForm || faceForm;
 
 if (form) {
     form.addEventListener('submit', function(e) {
-        if (!imageDataInput.value) {
+        if (!imageFileInput.files.length) {
             e.preventDefault();
             alert('Please capture a photo first');
             return false;
@@ -0,0 +1,108 @@
+from flask.json.provider import DefaultJSONProvider
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
+from config import Config
+from datetime import datetime, timezone
+from functools import lru_cache
+import io
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that encodes and decodes with orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.pop('indent', None):
+            option |= orjson.OPT_INDENT_2
+        kwargs.pop('separators', None)
+        if kwargs:
+            # Options orjson has no equivalent for go to the stdlib encoder
+            return super().dumps(obj, **kwargs)
+        # Datetimes go through Flask's default so they keep the HTTP date format
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+    
+    def loads(self, s, **kwargs):
+        if kwargs:
+            # e.g. the session serializer's object_hook for tagged values
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+# Timezone helper functions
+def get_ist_time():
+    """Get current time in IST"""
+    return datetime.now(Config.TIMEZONE)
+
+def utc_to_ist(utc_dt):
+    """Convert UTC datetime to IST"""
+    if utc_dt is None:
+        return None
+    if utc_dt.tzinfo is None:
+        utc_dt = utc_dt.replace(tzinfo=timezone.utc)
+    return utc_dt.astimezone(Config.TIMEZONE)
+
+def ist_to_utc(ist_dt):
+    """Convert IST datetime to UTC for database storage"""
+    if ist_dt is None:
+        return None
+    if ist_dt.tzinfo is None:
+        ist_dt = ist_dt.replace(tzinfo=Config.TIMEZONE)
+    return ist_dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+@lru_cache(maxsize=8)
+def ist_day_bounds_utc(day):
+    """Get the UTC datetimes of the first and last instant of an IST day"""
+    return (
+        ist_to_utc(datetime.combine(day, datetime.min.time())),
+        ist_to_utc(datetime.combine(day, datetime.max.time()))
+    )
+
+def month_range(year, month):
+    """Get [start, end) datetimes bounding a calendar month of stored timestamps"""
+    start = datetime(year, month, 1)
+    end = datetime(year + (month == 12), month % 12 + 1, 1)
+    return start, end
+
+# CompreFace API endpoints
+COMPREFACE_BASE_URL = f"{Config.COMPREFACE_URL}/api/v1"
+HEADERS = {
+    'x-api-key': Config.COMPREFACE_API_KEY
+}
+
+# Shared HTTP session so connections to CompreFace are kept alive and pooled
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(total=2, backoff_factor=0.1)
+)
+SESSION.mount('http://', _adapter)
+SESSION.mount('https://', _adapter)
+
+class StreamBody:
+    """Expose only read() and len so MultipartEncoder reads a stream in place"""
+    # MultipartEncoder copies anything with getvalue() (BytesIO) and calls
+    # fileno() on the rest, which rolls a SpooledTemporaryFile over to disk
+    
+    def __init__(self, stream):
+        self._stream = stream
+        self._end = stream.seek(0, io.SEEK_END)
+        stream.seek(0)
+    
+    @property
+    def len(self):
+        return self._end - self._stream.tell()
+    
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+# Longest data-URL header we expect, e.g. "data:image/jpeg;base64,"
+DATA_URL_HEADER_MAX = 64
+
+def base64_payload(image_data):
+    """Strip the optional data-URL header from a base64 image"""
+    # Only the short header can hold the comma, so the partition never walks
+    # the payload; a data URL costs one slice of the payload after the header.
+    head, sep, _ = image_data[:DATA_URL_HEADER_MAX].partition(',')
+    return image_data[len(head) + 1:] if sep else image_data